@@ -0,0 +1,219 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from db import create_partition, finish_partition, search_similar
+from embedding.base import vector_dim
+
+N_RESULTS = 10
+# Discussion forum replies are near-duplicates of a few posts
+DISCOURSE_CLUSTERS = 20
+TERM_DAYS = 120
+
+
+def term_start(term: int) -> datetime:
+    return datetime(2024, 1, 1) + timedelta(days=TERM_DAYS * (term - 1))
+
+
+def random_vectors(
+    rng: np.random.Generator, n: int, centers: np.ndarray | None = None
+) -> np.ndarray:
+    if centers is None:
+        vectors = rng.standard_normal((n, vector_dim))
+    else:
+        vectors = centers[rng.integers(len(centers), size=n)]
+        vectors = vectors + 0.1 * rng.standard_normal((n, vector_dim))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def term_rows(
+    rng: np.random.Generator,
+    term: int,
+    n_tds: int,
+    n_discourse: int,
+    centers: np.ndarray,
+) -> dict[str, pd.DataFrame]:
+    rows = {}
+    # Course content is undated, forum posts are spread over the term
+    days = rng.uniform(0, TERM_DAYS, n_discourse)
+    for source, vectors, created_at in [
+        ("tds", random_vectors(rng, n_tds), None),
+        (
+            "discourse",
+            random_vectors(rng, n_discourse, centers),
+            [term_start(term) + timedelta(days=d) for d in days],
+        ),
+    ]:
+        rows[source] = pd.DataFrame(
+            {
+                "source": source,
+                "text": [f"{source} term {term} #{i}" for i in range(len(vectors))],
+                "metadata": json.dumps({"url": f"https://example.com/{source}"}),
+                "embedding": vectors.tolist(),
+                "created_at": created_at,
+            }
+        )
+    return rows
+
+
+def insert(conn: duckdb.DuckDBPyConnection, table: str, df: pd.DataFrame):
+    conn.register("new_rows", df)
+    conn.execute(
+        f"""
+        INSERT INTO {table} (source, text, metadata, embedding, created_at)
+        SELECT
+            source,
+            text,
+            metadata,
+            CAST(embedding AS FLOAT[{vector_dim}]),
+            CAST(created_at AS TIMESTAMP)
+        FROM new_rows
+    """
+    )
+    conn.unregister("new_rows")
+
+
+def search_monolithic(
+    conn: duckdb.DuckDBPyConnection,
+    query_vector: list[float],
+    source: str | None,
+    date_from: datetime | None = None,
+) -> list[str]:
+    conditions = []
+    params = []
+    if source:
+        conditions.append("source = ?")
+        params.append(source)
+    if date_from:
+        conditions.append("(created_at IS NULL OR created_at >= ?)")
+        params.append(date_from)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return [
+        row[0]
+        for row in conn.execute(
+            f"""
+            SELECT source, array_distance(embedding, CAST(? AS FLOAT[{vector_dim}])) as distance
+            FROM data
+            {where}
+            ORDER BY distance
+            LIMIT ?
+        """,
+            [query_vector, *params, N_RESULTS],
+        ).fetchall()
+    ]
+
+
+def timed(search, queries: list[list[float]]) -> tuple[float, list]:
+    """Mean latency in milliseconds, and the results of each query."""
+    start = time.perf_counter()
+    results = [search(q) for q in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def tds_share(results: list[list[str]]) -> float:
+    return sum(r.count("tds") for r in results) / sum(len(r) for r in results)
+
+
+def main(args: argparse.Namespace):
+    rng = np.random.default_rng(0)
+    conn = duckdb.connect()
+    conn.install_extension("vss")
+    conn.load_extension("vss")
+
+    conn.execute(
+        """
+        CREATE TABLE partitions (
+            name TEXT PRIMARY KEY,
+            source TEXT,
+            min_created_at TIMESTAMP,
+            max_created_at TIMESTAMP
+        )
+    """
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE data (
+            source TEXT,
+            text TEXT,
+            metadata TEXT,
+            embedding FLOAT[{vector_dim}],
+            created_at TIMESTAMP,
+            is_accepted_answer BOOLEAN
+        )
+    """
+    )
+    conn.execute("CREATE INDEX data_vector_idx ON data USING HNSW (embedding)")
+
+    print(
+        f"{'terms':>5} {'rows':>7} | {'all: mono':>9} {'part':>7} | "
+        f"{'tds: mono':>9} {'part':>7} | {'term: mono':>10} {'part':>7} | "
+        f"{'tds share: mono':>15} {'quota':>6}"
+    )
+    # Questions about the forum topics, which crowd out the course material
+    centers = random_vectors(rng, DISCOURSE_CLUSTERS)
+    queries = random_vectors(rng, args.queries, centers).tolist()
+    for term in range(1, args.terms + 1):
+        for source, df in term_rows(
+            rng, term, args.tds_per_term, args.discourse_per_term, centers
+        ).items():
+            insert(conn, "data", df)
+            name = f"{source}_t{term}"
+            insert(conn, create_partition(conn, name, source), df)
+            finish_partition(conn, name)
+        n_rows = conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+
+        def titles(entries):
+            return [entry["text"].split()[0] for entry in entries]
+
+        mono_all, mono_all_results = timed(
+            lambda q: search_monolithic(conn, q, None), queries
+        )
+        part_all, _ = timed(
+            lambda q: titles(search_similar(conn, q, N_RESULTS)), queries
+        )
+        mono_tds, _ = timed(lambda q: search_monolithic(conn, q, "tds"), queries)
+        part_tds, _ = timed(
+            lambda q: titles(
+                search_similar(conn, q, N_RESULTS, filters={"sources": ["tds"]})
+            ),
+            queries,
+        )
+        # Questions about the current term only need its partitions
+        mono_term, _ = timed(
+            lambda q: search_monolithic(conn, q, None, term_start(term)), queries
+        )
+        part_term, _ = timed(
+            lambda q: titles(
+                search_similar(
+                    conn, q, N_RESULTS, filters={"date_from": term_start(term)}
+                )
+            ),
+            queries,
+        )
+        _, quota_results = timed(
+            lambda q: titles(
+                search_similar(conn, q, N_RESULTS, quotas={"discourse": 5})
+            ),
+            queries,
+        )
+        print(
+            f"{term:>5} {n_rows:>7} | {mono_all:>7.1f}ms {part_all:>5.1f}ms | "
+            f"{mono_tds:>7.1f}ms {part_tds:>5.1f}ms | "
+            f"{mono_term:>8.1f}ms {part_term:>5.1f}ms | "
+            f"{tds_share(mono_all_results):>15.0%} {tds_share(quota_results):>6.0%}"
+        )
+
+
+# Compare the monolithic index with one index per source and term
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--terms", type=int, default=6)
+    parser.add_argument("--tds-per-term", type=int, default=500)
+    parser.add_argument("--discourse-per-term", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,118 @@
+import glob
+import os
+import time
+
+from filelock import FileLock, Timeout
+
+from config import settings
+from db import current_db_path, get_duckdb, has_data, prepare_db, set_current_db_path
+from embedding.discourse import embed_discourse
+from embedding.tds import embed_tds
+
+
+def index_lock() -> FileLock:
+    # Not thread-local, so a lock taken by a request handler can be released
+    # by the background refresh
+    return FileLock(f"{settings.DUCKDB_PATH}.lock", thread_local=False)
+
+
+def try_index_lock() -> FileLock | None:
+    """Take the index lock, or return None if the index is being built."""
+    lock = index_lock()
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        return None
+    return lock
+
+
+def index_ready() -> bool:
+    db_path = current_db_path()
+    if not os.path.exists(db_path):
+        return False
+    my_duckdb = get_duckdb(read_only=True, db_path=db_path)
+    try:
+        return has_data(my_duckdb)
+    finally:
+        my_duckdb.close()
+
+
+def retire_old_versions(keep: set[str]):
+    """Delete the index files other than `keep`.
+
+    The previous version is kept too, as workers may still be finishing
+    requests on it. It is deleted by the next refresh.
+    """
+    root, ext = os.path.splitext(settings.DUCKDB_PATH)
+    for db_path in [settings.DUCKDB_PATH, *glob.glob(f"{root}-*{ext}")]:
+        if db_path in keep:
+            continue
+        for path in (db_path, f"{db_path}.wal"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not delete {path}: {e}")
+
+
+def _build():
+    """Build a new version of the index next to the served one, then switch."""
+    old_path = current_db_path()
+    root, ext = os.path.splitext(settings.DUCKDB_PATH)
+    new_path = f"{root}-{time.strftime('%Y%m%d%H%M%S')}{ext}"
+
+    prepare_db(new_path)
+    embed_tds("data/tds_course_content_links.parquet", new_path)
+    embed_discourse("data/discourse_posts.parquet", new_path)
+
+    set_current_db_path(new_path)
+    print(f"Now serving {new_path}")
+    retire_old_versions({new_path, old_path})
+
+
+def build_index():
+    """Create the database and embed the scraped data, unless already done.
+
+    A file lock makes sure only one process builds the index. Other processes
+    wait for the build to finish, then reuse the index. If an index exists,
+    the lock is not needed, so a refresh does not hold up starting workers.
+    """
+    if index_ready():
+        return
+    with index_lock():
+        # Another process may have built it while we waited
+        if index_ready():
+            return
+        _build()
+
+
+def refresh_index(lock: FileLock):
+    """Rebuild the index from the scraped data while the old one is served.
+
+    `lock` is the index lock, taken with `try_index_lock`, and is released
+    once the new index is served.
+    """
+    try:
+        _build()
+    finally:
+        lock.release()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the DuckDB index.")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Rebuild even if the index exists, without interrupting the app",
+    )
+    if parser.parse_args().refresh:
+        lock = try_index_lock()
+        if lock is None:
+            print("Index is already being built")
+        else:
+            refresh_index(lock)
+    else:
+        build_index()
@@ -5,6 +5,24 @@ class Settings(BaseSettings):
     OPENAI_BASE_URL: str = "https://api.openai.com/v1"
     OPENAI_API_KEY: str
     DUCKDB_PATH: str = "data/db.duckdb"
+    # Token for the /admin endpoints, which are disabled when unset
+    ADMIN_TOKEN: str | None = None
+    # Threads per worker process for DuckDB and the embedding model, 0 for all
+    # cores. Set to cores / workers when running several workers.
+    WORKER_THREADS: int = 0
+    # LLM call timeouts, in seconds: per attempt, and overall including retries
+    LLM_TIMEOUT: float = 30.0
+    LLM_DEADLINE: float = 60.0
+    LLM_MAX_RETRIES: int = 3
+    # Send a second request when the first is slower than the observed p95.
+    # LLM_HEDGE_DELAY is used until enough latencies have been observed.
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_DELAY: float = 5.0
+    # Concurrent LLM calls per batch, questions per /api/batch request, and
+    # where batch jobs are stored
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_QUESTIONS: int = 100
+    BATCH_JOBS_DIR: str = "data/jobs"
 
     class Config:
         env_file = ".env"
@@ -1,6 +1,11 @@
 # Connect to DuckDB and SQLite
 
 import json
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import TypedDict
 
 import duckdb
@@ -9,14 +14,61 @@ from config import settings
 from embedding.base import vector_dim
 
 
+# Preferred order of sources for results at the same distance
+SOURCE_RANK = {"tds": 0, "discourse": 1}
+PARTITION_NAME_RE = re.compile(r"[a-z0-9_]+")
+
+
 class DataEntry(TypedDict):
     text: str
     title: str
     url: str
 
 
-def get_duckdb():
-    db = duckdb.connect(settings.DUCKDB_PATH)
+class SearchFilters(TypedDict, total=False):
+    # None searches all sources, and an empty list none of them
+    sources: list[str] | None
+    # Strings are ISO dates, as saved in batch jobs
+    date_from: datetime | str | None
+    date_to: datetime | str | None
+    accepted_only: bool
+
+
+def naive_utc(value: datetime | str) -> datetime:
+    """Convert a date to naive UTC, the way `created_at` is stored."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def current_db_path() -> str:
+    """Path of the database file currently being served.
+
+    Refreshes build a new file and point to it from `<DUCKDB_PATH>.current`.
+    Without a pointer, `DUCKDB_PATH` itself is used.
+    """
+    try:
+        with open(f"{settings.DUCKDB_PATH}.current") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return settings.DUCKDB_PATH
+
+
+def set_current_db_path(db_path: str):
+    pointer = f"{settings.DUCKDB_PATH}.current"
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(db_path)
+    # Atomic, so readers see either the old or the new path
+    os.replace(f"{pointer}.tmp", pointer)
+
+
+def get_duckdb(read_only: bool = False, db_path: str | None = None):
+    # Several processes can open the file read-only, but only one read-write
+    db = duckdb.connect(db_path or current_db_path(), read_only=read_only)
+    if settings.WORKER_THREADS:
+        db.execute(f"SET threads = {settings.WORKER_THREADS}")
 
     db.install_extension("parquet")
     db.load_extension("parquet")
@@ -28,56 +80,273 @@ def get_duckdb():
 
 def has_data(my_duckdb: duckdb.DuckDBPyConnection):
     try:
-        return my_duckdb.execute("SELECT COUNT(*) FROM data").fetchone()[0] > 0
+        return my_duckdb.execute("SELECT COUNT(*) FROM partitions").fetchone()[0] > 0
     except Exception:
         return False
 
 
-def prepare_db():
-    my_duckdb = get_duckdb()
-    my_duckdb.execute("DROP TABLE IF EXISTS data")
+def prepare_db(db_path: str):
+    """Create an empty index in a new file, never the one being served."""
+    my_duckdb = get_duckdb(db_path=db_path)
+    # Each partition has its own table and HNSW index, listed here with the
+    # range of its created_at dates
+    my_duckdb.execute("DROP TABLE IF EXISTS partitions")
     my_duckdb.execute(
-        f"CREATE TABLE data (source TEXT, text TEXT, metadata TEXT, embedding FLOAT[{vector_dim}])"
+        """
+        CREATE TABLE partitions (
+            name TEXT PRIMARY KEY,
+            source TEXT,
+            min_created_at TIMESTAMP,
+            max_created_at TIMESTAMP
+        )
+    """
+    )
+    my_duckdb.close()
+
+
+def create_partition(
+    my_duckdb: duckdb.DuckDBPyConnection,
+    name: str,
+    source: str,
+) -> str:
+    """Create the table and HNSW index of a partition, and return the table.
+
+    A source can be split into several partitions, e.g. one per term.
+    """
+    if not PARTITION_NAME_RE.fullmatch(name):
+        raise ValueError(f"Invalid partition name: {name}")
+    table = f"data_{name}"
+    my_duckdb.execute(f"DROP TABLE IF EXISTS {table}")
+    my_duckdb.execute(
+        f"""
+        CREATE TABLE {table} (
+            source TEXT,
+            text TEXT,
+            metadata TEXT,
+            embedding FLOAT[{vector_dim}],
+            created_at TIMESTAMP,
+            is_accepted_answer BOOLEAN
+        )
+    """
     )
     # Enable experimental persistence for HNSW indexes
     my_duckdb.execute("SET hnsw_enable_experimental_persistence=true")
 
     # Create the HNSW index
-    my_duckdb.execute("CREATE INDEX vector_idx ON data USING HNSW (embedding)")
+    my_duckdb.execute(
+        f"CREATE INDEX {table}_vector_idx ON {table} USING HNSW (embedding)"
+    )
+    my_duckdb.execute(
+        "INSERT OR REPLACE INTO partitions (name, source) VALUES (?, ?)",
+        [name, source],
+    )
+    return table
+
+
+def finish_partition(my_duckdb: duckdb.DuckDBPyConnection, name: str):
+    """Record the range of created_at dates of a partition, once it is filled.
+
+    The range is left NULL if some rows have no date, as the date filters
+    never exclude those rows.
+    """
+    table = f"data_{name}"
+    my_duckdb.execute(
+        f"""
+        UPDATE partitions
+        SET min_created_at = bounds.min_created_at,
+            max_created_at = bounds.max_created_at
+        FROM (
+            SELECT
+                CASE WHEN COUNT(*) = COUNT(created_at) THEN MIN(created_at) END AS min_created_at,
+                CASE WHEN COUNT(*) = COUNT(created_at) THEN MAX(created_at) END AS max_created_at
+            FROM {table}
+        ) AS bounds
+        WHERE name = ?
+    """,
+        [name],
+    )
+
+
+class IndexReader:
+    """Read-only connections to the current index, switched on refresh.
+
+    When the index is refreshed, new requests get the new index, and the old
+    connection is closed once the requests still using it are done.
+    """
+
+    def __init__(self):
+        self.db_path: str | None = None
+        self.conn: duckdb.DuckDBPyConnection | None = None
+        self.users: Counter[duckdb.DuckDBPyConnection] = Counter()
+
+    @contextmanager
+    def cursor(self):
+        db_path = current_db_path()
+        if db_path != self.db_path:
+            old_conn = self.conn
+            self.conn = get_duckdb(read_only=True, db_path=db_path)
+            self.db_path = db_path
+            if old_conn is not None and not self.users[old_conn]:
+                old_conn.close()
+
+        conn = self.conn
+        self.users[conn] += 1
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self.users[conn] -= 1
+            if not self.users[conn]:
+                del self.users[conn]
+                if conn is not self.conn:
+                    conn.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
 
 
 def search_similar(
     conn: duckdb.DuckDBPyConnection,
     query_vector: list[float],
     n_results: int = 1,
+    filters: SearchFilters | None = None,
+    quotas: dict[str, int] | None = None,
 ) -> list[DataEntry]:
     """Search for documents similar to query using vector similarity."""
+    return search_similar_batch(conn, [query_vector], n_results, filters, quotas)[0]
 
-    # Search using HNSW index with explicit FLOAT[] cast
-    results = conn.execute(
-        f"""
-        SELECT source, text, metadata, array_distance(embedding, CAST(? AS FLOAT[{vector_dim}])) as distance
-        FROM data
-        ORDER BY
-            distance,
-            CASE 
-                WHEN source = 'tds' THEN 0
-                WHEN source = 'discourse' THEN 1
-                ELSE 2
-            END
-        LIMIT ?
-    """,
-        [query_vector, n_results],
+
+def search_similar_batch(
+    conn: duckdb.DuckDBPyConnection,
+    query_vectors: list[list[float]],
+    n_results: int = 1,
+    filters: SearchFilters | None = None,
+    quotas: dict[str, int] | None = None,
+) -> list[list[DataEntry]]:
+    """Search for documents similar to each query, one query per partition.
+
+    Only the partitions of the sources in `filters`, and with dates in its
+    range, are searched. `quotas` caps the number of results from each source,
+    so that one source cannot crowd out the others. The results of all
+    partitions are merged by distance.
+    """
+    filters = dict(filters or {})
+    for key in ("date_from", "date_to"):
+        if filters.get(key):
+            filters[key] = naive_utc(filters[key])
+    sources = filters.get("sources")
+    date_from = filters.get("date_from")
+    date_to = filters.get("date_to")
+    partitions = conn.execute(
+        "SELECT name, source, min_created_at, max_created_at FROM partitions"
     ).fetchall()
 
+    candidates: list[list[tuple]] = [[] for _ in query_vectors]
+    for name, source, min_created_at, max_created_at in partitions:
+        if sources is not None and source not in sources:
+            continue
+        # Partitions of other dates, e.g. past terms, have no matching rows
+        if date_from and max_created_at and max_created_at < date_from:
+            continue
+        if date_to and min_created_at and min_created_at > date_to:
+            continue
+        k = min(n_results, quotas.get(source, n_results)) if quotas else n_results
+        if k <= 0:
+            continue
+        rows = _search_partition(conn, f"data_{name}", query_vectors, k, filters)
+        for query_id, source, text, mtdata, distance in rows:
+            # Source preference is a tie-breaker for equal distances
+            rank = SOURCE_RANK.get(source, len(SOURCE_RANK))
+            candidates[query_id - 1].append((distance, rank, source, text, mtdata))
+
     res = []
-    for source, text, mtdata, distance in results:
-        metadata = json.loads(mtdata)
-        title = (
-            metadata.get("course_title", "")
-            if source == "tds"
-            else metadata.get("topic_title", "")
-        )
-        url = metadata.get("url", "")
-        res.append(DataEntry(text=text, title=title, url=url))
+    for rows in candidates:
+        rows.sort(key=lambda row: row[:2])
+        counts: Counter[str] = Counter()
+        entries = []
+        for _, _, source, text, mtdata in rows:
+            if quotas and counts[source] >= quotas.get(source, n_results):
+                continue
+            counts[source] += 1
+            entries.append(to_entry(source, text, mtdata))
+            if len(entries) == n_results:
+                break
+        res.append(entries)
     return res
+
+
+def _filter_sql(filters: SearchFilters) -> tuple[str, list]:
+    """Build the WHERE clause for the filters.
+
+    Rows without a date or an accepted flag, like course content, are not
+    filtered out by them. Dates must already be naive UTC.
+    """
+    conditions = []
+    params = []
+    if filters.get("date_from"):
+        conditions.append("(created_at IS NULL OR created_at >= ?)")
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        conditions.append("(created_at IS NULL OR created_at <= ?)")
+        params.append(filters["date_to"])
+    if filters.get("accepted_only"):
+        conditions.append("is_accepted_answer IS NOT FALSE")
+    if not conditions:
+        return "", params
+    return f"WHERE {' AND '.join(conditions)}", params
+
+
+def _search_partition(
+    conn: duckdb.DuckDBPyConnection,
+    table: str,
+    query_vectors: list[list[float]],
+    k: int,
+    filters: SearchFilters,
+) -> list[tuple]:
+    where, params = _filter_sql(filters)
+    if len(query_vectors) == 1:
+        # Search using HNSW index with explicit FLOAT[] cast
+        return conn.execute(
+            f"""
+            SELECT 1 AS query_id, source, text, metadata, array_distance(embedding, CAST(? AS FLOAT[{vector_dim}])) as distance
+            FROM {table}
+            {where}
+            ORDER BY distance
+            LIMIT ?
+        """,
+            [query_vectors[0], *params, k],
+        ).fetchall()
+
+    # Top-k lateral join, which the HNSW index can serve for all queries at once.
+    # generate_subscripts is 1-based.
+    return conn.execute(
+        f"""
+        WITH queries AS (
+            SELECT
+                generate_subscripts(?, 1) AS query_id,
+                CAST(unnest(?) AS FLOAT[{vector_dim}]) AS query_vector
+        )
+        SELECT query_id, source, text, metadata, distance
+        FROM queries, LATERAL (
+            SELECT source, text, metadata, array_distance(embedding, query_vector) as distance
+            FROM {table}
+            {where}
+            ORDER BY distance
+            LIMIT ?
+        )
+    """,
+        [query_vectors, query_vectors, *params, k],
+    ).fetchall()
+
+
+def to_entry(source: str, text: str, mtdata: str) -> DataEntry:
+    metadata = json.loads(mtdata)
+    title = (
+        metadata.get("course_title", "")
+        if source == "tds"
+        else metadata.get("topic_title", "")
+    )
+    url = metadata.get("url", "")
+    return DataEntry(text=text, title=title, url=url)
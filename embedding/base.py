@@ -1,5 +1,11 @@
+import torch
 from sentence_transformers import SentenceTransformer
 
+from config import settings
+
+if settings.WORKER_THREADS:
+    torch.set_num_threads(settings.WORKER_THREADS)
+
 model = SentenceTransformer("BAAI/bge-base-en-v1.5")
 vector_dim = model.get_sentence_embedding_dimension()
 
@@ -2,13 +2,14 @@ import json
 
 from tqdm import tqdm
 
-from db import get_duckdb, prepare_db
+from db import create_partition, finish_partition, get_duckdb, naive_utc
 from embedding.base import get_embedding
 
 
-def embed_discourse(file_path: str):
+def embed_discourse(file_path: str, db_path: str, partition: str = "discourse"):
     # Setup OpenAI and database connections
-    my_duckdb = get_duckdb()
+    my_duckdb = get_duckdb(db_path=db_path)
+    table = create_partition(my_duckdb, partition, "discourse")
 
     # Query discourse posts
     discourse_posts = my_duckdb.execute(f"SELECT * FROM '{file_path}'").fetchall()
@@ -32,13 +33,33 @@ def embed_discourse(file_path: str):
             "url": post.get("url"),
         }
         my_duckdb.execute(
-            "INSERT INTO data (source, text, metadata, embedding) VALUES (?, ?, ?, ?)",
-            ("discourse", text, json.dumps(metadata), embedding),
+            f"""
+            INSERT INTO {table} (source, text, metadata, embedding, created_at, is_accepted_answer)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                "discourse",
+                text,
+                json.dumps(metadata),
+                embedding,
+                # Discourse dates are ISO strings in UTC
+                naive_utc(post["created_at"]) if post.get("created_at") else None,
+                metadata["is_accepted_answer"],
+            ),
         )
 
+    finish_partition(my_duckdb, partition)
+    my_duckdb.close()
     print("Embeddings for Discourse posts stored.")
 
 
 if __name__ == "__main__":
-    prepare_db()
-    embed_discourse("data/discourse_posts.parquet")
+    # The index is rebuilt as a whole into a new file, never in place, as the
+    # current file may be served
+    from build_index import refresh_index, try_index_lock
+
+    lock = try_index_lock()
+    if lock is None:
+        print("Index is already being built")
+    else:
+        refresh_index(lock)
@@ -2,12 +2,13 @@ import json
 
 from tqdm import tqdm
 
-from db import get_duckdb, prepare_db
+from db import create_partition, finish_partition, get_duckdb
 from embedding.base import get_embedding
 
 
-def embed_tds(file_path: str):
-    my_duckdb = get_duckdb()
+def embed_tds(file_path: str, db_path: str, partition: str = "tds"):
+    my_duckdb = get_duckdb(db_path=db_path)
+    table = create_partition(my_duckdb, partition, "tds")
 
     # Read directly from the Parquet file
     tds_data = my_duckdb.execute(f"SELECT * FROM '{file_path}'").fetchall()
@@ -38,13 +39,22 @@ def embed_tds(file_path: str):
                 "links": links,
             }
             my_duckdb.execute(
-                "INSERT INTO data (source, text, metadata, embedding) VALUES (?, ?, ?, ?)",
+                f"INSERT INTO {table} (source, text, metadata, embedding) VALUES (?, ?, ?, ?)",
                 ("tds", text, json.dumps(metadata), embedding),
             )
 
+    finish_partition(my_duckdb, partition)
+    my_duckdb.close()
     print("Embeddings for TDS data stored.")
 
 
 if __name__ == "__main__":
-    prepare_db()
-    embed_tds("data/tds_course_content_links.parquet")
+    # The index is rebuilt as a whole into a new file, never in place, as the
+    # current file may be served
+    from build_index import refresh_index, try_index_lock
+
+    lock = try_index_lock()
+    if lock is None:
+        print("Index is already being built")
+    else:
+        refresh_index(lock)
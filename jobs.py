@@ -0,0 +1,108 @@
+import json
+import os
+import uuid
+
+from filelock import FileLock, Timeout
+
+from config import settings
+from db import IndexReader
+from qa import get_answers
+
+# Results are saved after each chunk, so an interrupted job loses at most one
+JOB_CHUNK_SIZE = 32
+
+
+def to_items(
+    answers: list[dict[str, str | list[dict[str, str]]] | Exception],
+) -> list[dict]:
+    return [
+        {"result": None, "error": f"{type(answer).__name__}: {answer}"}
+        if isinstance(answer, Exception)
+        else {"result": answer, "error": None}
+        for answer in answers
+    ]
+
+
+def unanswered(job: dict) -> list[int]:
+    """Indexes of the questions without a result, or whose answer failed."""
+    return [
+        i
+        for i, result in enumerate(job["results"])
+        if result is None or result["error"] is not None
+    ]
+
+
+def job_path(job_id: str) -> str:
+    return os.path.join(settings.BATCH_JOBS_DIR, f"{job_id}.json")
+
+
+def save_job(job: dict):
+    os.makedirs(settings.BATCH_JOBS_DIR, exist_ok=True)
+    path = job_path(job["id"])
+    # Write to a temporary file first so readers never see a partial job
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(job, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_job(job_id: str) -> dict | None:
+    try:
+        # Also rejects IDs that could escape the jobs directory
+        job_id = uuid.UUID(job_id).hex
+    except ValueError:
+        return None
+    try:
+        with open(job_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def create_job(questions: list[dict[str, str | None]]) -> dict:
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "pending",
+        "questions": questions,
+        "results": [None] * len(questions),
+    }
+    save_job(job)
+    return job
+
+
+async def run_job(index: IndexReader, job_id: str, max_sources: int):
+    """Answer the questions of a job that do not have an answer yet.
+
+    Running an interrupted or failed job again resumes it. A lock makes sure
+    a job runs in only one process at a time.
+    """
+    lock = FileLock(f"{job_path(job_id)}.lock")
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        # Already running
+        return
+
+    job = load_job(job_id)
+    try:
+        job["status"] = "running"
+        save_job(job)
+        # Questions that failed before are tried again
+        pending = unanswered(job)
+        for start in range(0, len(pending), JOB_CHUNK_SIZE):
+            chunk = pending[start : start + JOB_CHUNK_SIZE]
+            questions = [job["questions"][i] for i in chunk]
+            # A new cursor per chunk, so long jobs pick up index refreshes
+            with index.cursor() as my_duckdb:
+                answers = await get_answers(my_duckdb, questions, max_sources)
+            for i, item in zip(chunk, to_items(answers)):
+                job["results"][i] = item
+            save_job(job)
+        # Partial jobs have failed answers, and can be resumed
+        job["status"] = "partial" if unanswered(job) else "done"
+        save_job(job)
+    except Exception:
+        job["status"] = "failed"
+        save_job(job)
+        raise
+    finally:
+        lock.release()
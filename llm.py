@@ -0,0 +1,169 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+from config import settings
+
+# Retries and timeouts are handled here, not by the OpenAI client
+openai_client = AsyncOpenAI(
+    base_url=settings.OPENAI_BASE_URL,
+    api_key=settings.OPENAI_API_KEY,
+    max_retries=0,
+)
+
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# Minimum number of observed latencies before the hedge delay follows the p95
+HEDGE_MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Keeps a window of recent call latencies to estimate the p95."""
+
+    def __init__(self, window: int = 200):
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def p95(self) -> float | None:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+latency_tracker = LatencyTracker()
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    # Includes openai.APITimeoutError
+    return isinstance(error, openai.APIConnectionError)
+
+
+def hedge_delay() -> float:
+    return latency_tracker.p95() or settings.LLM_HEDGE_DELAY
+
+
+async def _attempt(**kwargs) -> ChatCompletion:
+    start = time.perf_counter()
+    try:
+        response = await openai_client.chat.completions.create(
+            timeout=settings.LLM_TIMEOUT, **kwargs
+        )
+    except asyncio.CancelledError:
+        # A request that lost to its hedge took at least this long. Leaving it
+        # out would bias the p95 down, and so fire more and more hedges.
+        latency_tracker.record(time.perf_counter() - start)
+        raise
+    latency_tracker.record(time.perf_counter() - start)
+    return response
+
+
+async def _hedged_attempt(**kwargs) -> ChatCompletion:
+    """Send a request, and a second one if the first is slower than the p95.
+
+    The first successful response wins and the other request is cancelled.
+    """
+    pending = {asyncio.create_task(_attempt(**kwargs))}
+    hedged = False
+    error: Exception | None = None
+    try:
+        while True:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=None if hedged else hedge_delay(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            # Failures before the hedge delay are left to the retry loop
+            if not pending:
+                raise error
+            if not hedged:
+                hedged = True
+                pending.add(asyncio.create_task(_attempt(**kwargs)))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def chat_completion(**kwargs) -> ChatCompletion:
+    """Call the chat completions API with a deadline, retries and hedging.
+
+    Each attempt is limited to `LLM_TIMEOUT` seconds and the whole call,
+    including retries, to `LLM_DEADLINE` seconds. Rate limits, server errors
+    and connection errors are retried with jittered exponential backoff.
+    """
+    attempt = _hedged_attempt if settings.LLM_HEDGE_ENABLED else _attempt
+    async with asyncio.timeout(settings.LLM_DEADLINE):
+        for retry in range(settings.LLM_MAX_RETRIES + 1):
+            try:
+                return await attempt(**kwargs)
+            except Exception as e:
+                if retry == settings.LLM_MAX_RETRIES or not is_retryable(e):
+                    raise
+            # Full jitter backoff
+            backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**retry)
+            await asyncio.sleep(random.uniform(0, backoff))
+
+
+async def benchmark(n_requests: int, concurrency: int) -> list[float]:
+    """Time `n_requests` calls, at most `concurrency` of them at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await chat_completion(
+                    model="gpt-4.1-nano",
+                    messages=[{"role": "user", "content": "ping"}],
+                )
+            except Exception as e:
+                print(f"Request failed: {e!r}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(call() for _ in range(n_requests)))
+    return sorted(latencies)
+
+
+async def compare_hedging(n_requests: int, concurrency: int):
+    p99s = {}
+    for hedging in (False, True):
+        settings.LLM_HEDGE_ENABLED = hedging
+        latencies = await benchmark(n_requests, concurrency)
+        if not latencies:
+            continue
+        p50, p95, p99 = (
+            latencies[int(p * (len(latencies) - 1))] for p in (0.5, 0.95, 0.99)
+        )
+        p99s[hedging] = p99
+        print(
+            f"hedging={'on' if hedging else 'off':<3} ok={len(latencies)}/{n_requests} "
+            f"p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms p99={p99 * 1000:.0f}ms"
+        )
+    if len(p99s) == 2:
+        print(f"p99 improvement: {1 - p99s[True] / p99s[False]:.1%}")
+
+
+# Compare tail latency with and without hedging, e.g. against stub_llm.py
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(compare_hedging(args.requests, args.concurrency))
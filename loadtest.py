@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import base64
+import itertools
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+import yaml
+
+DEFAULT_CONFIG = "project-tds-virtual-ta-promptfoo.yaml"
+
+
+@dataclass
+class StageResult:
+    concurrency: int
+    batch_size: int = 1
+    duration: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self) -> float:
+        """Questions answered per second."""
+        if not self.duration:
+            return 0.0
+        return len(self.latencies) * self.batch_size / self.duration
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+        return ordered[index]
+
+
+def load_questions(config_path: str) -> tuple[str, list[dict[str, str]]]:
+    """Read the API URL and the request payloads from a promptfoo config."""
+    config_file = Path(config_path)
+    config = yaml.safe_load(config_file.read_text())
+    url = config["providers"][0]["config"]["url"]
+
+    payloads = []
+    for test in config.get("tests", []):
+        test_vars = test.get("vars", {})
+        payload = {"question": test_vars["question"]}
+        image = test_vars.get("image")
+        if image:
+            # promptfoo loads `file://` vars relative to the config file
+            if image.startswith("file://"):
+                image_path = config_file.parent / image.removeprefix("file://")
+                image = base64.b64encode(image_path.read_bytes()).decode()
+            payload["image"] = image
+        payloads.append(payload)
+    return url, payloads
+
+
+async def run_stage(
+    client: httpx.AsyncClient,
+    url: str,
+    payloads: list[dict[str, str]],
+    concurrency: int,
+    ramp_up: float,
+    duration: float,
+    batch_size: int = 0,
+) -> StageResult:
+    """Replay the payloads with `concurrency` workers for `duration` seconds.
+
+    Workers are started evenly over `ramp_up` seconds, and only requests
+    started after the ramp-up are measured. With a `batch_size`, each request
+    sends that many questions to the batch endpoint instead.
+    """
+    result = StageResult(concurrency=concurrency, batch_size=batch_size or 1)
+    questions = itertools.cycle(payloads)
+    batch_url = f"{url.rstrip('/')}/batch"
+    start = time.perf_counter()
+    measure_from = start + ramp_up
+    stop_at = measure_from + duration
+
+    async def worker(delay: float):
+        await asyncio.sleep(delay)
+        while (sent_at := time.perf_counter()) < stop_at:
+            try:
+                if batch_size:
+                    batch = [next(questions) for _ in range(batch_size)]
+                    response = await client.post(batch_url, json=batch)
+                    ok = response.status_code == 200 and all(
+                        item["error"] is None for item in response.json()
+                    )
+                else:
+                    response = await client.post(url, json=next(questions))
+                    ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if sent_at < measure_from:
+                continue
+            if ok:
+                result.latencies.append(time.perf_counter() - sent_at)
+            else:
+                result.errors += 1
+
+    await asyncio.gather(
+        *(worker(ramp_up * i / concurrency) for i in range(concurrency))
+    )
+    result.duration = time.perf_counter() - measure_from
+    return result
+
+
+def print_report(results: list[StageResult]):
+    header = (
+        f"{'conc':>5} {'reqs':>6} {'q/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.concurrency:>5} {r.requests:>6} {r.throughput:>8.2f} "
+            f"{r.percentile(50) * 1000:>8.1f} {r.percentile(95) * 1000:>8.1f} "
+            f"{r.percentile(99) * 1000:>8.1f} {r.error_rate:>7.1%}"
+        )
+
+    # Saturation curve: throughput gained per added worker
+    print("\nSaturation curve:")
+    peak = max((r.throughput for r in results), default=0.0)
+    for r in results:
+        bar = "#" * round(40 * r.throughput / peak) if peak else ""
+        print(f"{r.concurrency:>5} | {bar} {r.throughput:.2f} q/s")
+
+
+async def main(args: argparse.Namespace):
+    url, payloads = load_questions(args.config)
+    url = args.url or url
+    print(f"Replaying {len(payloads)} questions against {url}")
+
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for concurrency in args.concurrency:
+            print(f"Running {concurrency} concurrent workers...")
+            results.append(
+                await run_stage(
+                    client,
+                    url,
+                    payloads,
+                    concurrency,
+                    args.ramp_up,
+                    args.duration,
+                    args.batch_size,
+                )
+            )
+    print()
+    print_report(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay the promptfoo questions against a running app."
+    )
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--url", help="Override the URL from the promptfoo config")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda s: [int(c) for c in s.split(",")],
+        default=[1, 2, 4, 8, 16],
+        help="Comma-separated concurrency levels, one stage each",
+    )
+    parser.add_argument("--ramp-up", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help="Send this many questions per request to the batch endpoint",
+    )
+    asyncio.run(main(parser.parse_args()))
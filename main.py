@@ -1,39 +1,65 @@
 import base64
+import secrets
 from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Annotated
 
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request
 from pydantic import BaseModel, Field, HttpUrl, field_validator
 
-from db import get_duckdb, has_data, prepare_db
-from embedding.discourse import embed_discourse
-from embedding.tds import embed_tds
-from qa import get_answer
+from build_index import build_index, refresh_index, try_index_lock
+from config import settings
+from db import IndexReader, naive_utc
+from jobs import create_job, load_job, run_job, to_items, unanswered
+from qa import get_answer, get_answers
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting up...")
-    my_duckdb = get_duckdb()
-    if not has_data(my_duckdb):
-        prepare_db()
-        embed_tds("data/tds_course_content_links.parquet")
-        embed_discourse("data/discourse_posts.parquet")
-    my_duckdb.close()
+    build_index()
+    # Workers only read the index, so any number of them can share the file
+    app.state.index = IndexReader()
     print("Startup complete")
 
     yield
 
     # Shutdown
+    app.state.index.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+class SearchFiltersRequest(BaseModel):
+    sources: Annotated[
+        list[str] | None,
+        Field(
+            description="Sources to search, e.g. tds, discourse. Omit to search all",
+            min_length=1,
+        ),
+    ] = None
+    date_from: datetime | None = None
+    date_to: datetime | None = None
+    accepted_only: Annotated[
+        bool, Field(description="Only accepted answers from the discussion forum")
+    ] = False
+
+    @field_validator("date_from", "date_to")
+    def validate_date(cls, v: datetime | None) -> datetime | None:
+        # Dates are compared with created_at, which is stored as naive UTC
+        return naive_utc(v) if v else v
+
+
 class QuestionRequest(BaseModel):
     question: str
     image: Annotated[str | None, Field(description="Optional base64 image")] = None
+    filters: SearchFiltersRequest | None = None
+    quotas: Annotated[
+        dict[str, Annotated[int, Field(ge=0)]] | None,
+        Field(description="Maximum number of sources used from each source"),
+    ] = None
 
     @field_validator("image")
     def validate_image(cls, v: str | None) -> str | None:
@@ -56,14 +82,107 @@ class QuestionResponse(BaseModel):
     links: list[Link]
 
 
+class BatchItem(BaseModel):
+    result: QuestionResponse | None = None
+    error: str | None = None
+
+
+class BatchJob(BaseModel):
+    id: str
+    status: str
+    results: list[BatchItem | None]
+
+
 async def process_question(
     data: QuestionRequest,
+    request: Request,
 ) -> dict[str, str | list[dict[str, str]]]:
-    my_duckdb = get_duckdb()
-    return get_answer(my_duckdb, data.question, data.image, max_sources=10)
+    filters = data.filters.model_dump() if data.filters else None
+    with request.app.state.index.cursor() as my_duckdb:
+        return await get_answer(
+            my_duckdb,
+            data.question,
+            data.image,
+            max_sources=10,
+            filters=filters,
+            quotas=data.quotas,
+        )
 
 
 # Without forwarding slash is the standard
 # but forward slash is mentioned in the project description
 app.post("/api", response_model=QuestionResponse)(process_question)
 app.post("/api/", response_model=QuestionResponse)(process_question)
+
+
+@app.post("/api/batch", response_model=list[BatchItem])
+async def process_batch(
+    data: list[QuestionRequest],
+    request: Request,
+) -> list[dict]:
+    # Larger batches should be run as jobs
+    if len(data) > settings.BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.BATCH_MAX_QUESTIONS} questions per batch",
+        )
+    with request.app.state.index.cursor() as my_duckdb:
+        answers = await get_answers(
+            my_duckdb, [q.model_dump() for q in data], max_sources=10
+        )
+    return to_items(answers)
+
+
+@app.post("/api/batch/jobs", response_model=BatchJob)
+async def create_batch_job(
+    data: list[QuestionRequest],
+    request: Request,
+    background_tasks: BackgroundTasks,
+) -> dict:
+    job = create_job([q.model_dump(mode="json") for q in data])
+    background_tasks.add_task(
+        run_job, request.app.state.index, job["id"], max_sources=10
+    )
+    return job
+
+
+@app.get("/api/batch/jobs/{job_id}", response_model=BatchJob)
+async def get_batch_job(job_id: str) -> dict:
+    job = load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/api/batch/jobs/{job_id}/resume", response_model=BatchJob)
+async def resume_batch_job(
+    job_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+) -> dict:
+    job = load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if unanswered(job):
+        background_tasks.add_task(
+            run_job, request.app.state.index, job["id"], max_sources=10
+        )
+    return job
+
+
+@app.post("/admin/refresh", status_code=202)
+async def refresh(
+    background_tasks: BackgroundTasks,
+    authorization: Annotated[str | None, Header()] = None,
+) -> dict[str, str]:
+    # Disabled unless an admin token is configured
+    if not settings.ADMIN_TOKEN or not secrets.compare_digest(
+        (authorization or "").encode(), f"Bearer {settings.ADMIN_TOKEN}".encode()
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    lock = try_index_lock()
+    if lock is None:
+        raise HTTPException(status_code=409, detail="Index is already being built")
+    # Runs in a thread pool, so requests are served during the rebuild
+    background_tasks.add_task(refresh_index, lock)
+    return {"status": "Refresh started"}
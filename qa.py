@@ -1,27 +1,150 @@
+import asyncio
 import json
+import re
 from itertools import chain
 
 import duckdb
-from openai import OpenAI
 
 from config import settings
-from db import get_duckdb, search_similar
+from db import (
+    DataEntry,
+    SearchFilters,
+    get_duckdb,
+    search_similar,
+    search_similar_batch,
+)
 from embedding.base import model
+from llm import chat_completion
 
-openai_client = OpenAI(
-    base_url=settings.OPENAI_BASE_URL,
-    api_key=settings.OPENAI_API_KEY,
-)
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+def _json_candidates(content: str):
+    """Yield the JSON values found in a model reply, most likely first."""
+    for candidate in [content, *FENCE_RE.findall(content)]:
+        try:
+            yield json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+    # JSON objects surrounded by prose
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", content):
+        try:
+            yield decoder.raw_decode(content, match.start())[0]
+        except json.JSONDecodeError:
+            pass
+
+
+def parse_answer(content: str, n_links: int) -> tuple[str, list[int]]:
+    """Parse the model reply into the answer and the indexes of the used texts.
+
+    The JSON object may be wrapped in code fences or surrounded by prose.
+    Indexes that are not valid for the `n_links` texts are dropped. If no JSON
+    object with an answer is found, the whole reply is used as the answer.
+    """
+    for response_data in _json_candidates(content):
+        if not isinstance(response_data, dict) or not isinstance(
+            response_data.get("answer"), str
+        ):
+            continue
+        text_indexes = response_data.get("text_indexes")
+        if not isinstance(text_indexes, list):
+            text_indexes = []
+        valid_indexes = []
+        for i in text_indexes:
+            # bool is a subclass of int, but true/false are not indexes
+            if isinstance(i, bool) or not isinstance(i, int):
+                continue
+            if 0 <= i < n_links and i not in valid_indexes:
+                valid_indexes.append(i)
+        return response_data["answer"], valid_indexes
+
+    return content.strip(), []
 
 
-def get_answer(
+async def get_answer(
     my_duckdb: duckdb.DuckDBPyConnection,
     query: str,
     image_data: str | None,
     max_sources: int,
+    filters: SearchFilters | None = None,
+    quotas: dict[str, int] | None = None,
 ) -> dict[str, str | list[dict[str, str]]]:
     query_vector = model.encode(query).tolist()
-    entries = search_similar(my_duckdb, query_vector, max_sources)
+    entries = search_similar(my_duckdb, query_vector, max_sources, filters, quotas)
+    return await answer_from_entries(query, image_data, entries)
+
+
+def search_batch(
+    my_duckdb: duckdb.DuckDBPyConnection,
+    questions: list[dict],
+    max_sources: int,
+) -> list[list[DataEntry]]:
+    """Find the sources for each question, encoding and searching in batches."""
+    query_vectors = model.encode([q["question"] for q in questions]).tolist()
+
+    # Questions with the same filters and quotas are searched together
+    groups: dict[str, list[int]] = {}
+    for i, q in enumerate(questions):
+        key = json.dumps(
+            [q.get("filters"), q.get("quotas")], sort_keys=True, default=str
+        )
+        groups.setdefault(key, []).append(i)
+    all_entries: list[list[DataEntry]] = [[] for _ in questions]
+    for indexes in groups.values():
+        first = questions[indexes[0]]
+        results = search_similar_batch(
+            my_duckdb,
+            [query_vectors[i] for i in indexes],
+            max_sources,
+            first.get("filters"),
+            first.get("quotas"),
+        )
+        for i, entries in zip(indexes, results):
+            all_entries[i] = entries
+    return all_entries
+
+
+async def get_answers(
+    my_duckdb: duckdb.DuckDBPyConnection,
+    questions: list[dict],
+    max_sources: int,
+) -> list[dict[str, str | list[dict[str, str]]] | Exception]:
+    """Answer several questions, in order.
+
+    Each question is a dict with the fields of a question request. The
+    questions are encoded as one batch, and searched as one batch per set of
+    filters and quotas. Then at most `BATCH_CONCURRENCY` LLM calls run at
+    once. A failed LLM call is returned as the exception in place of its answer.
+    """
+    if not questions:
+        return []
+    # Encoding and searching a large batch takes a while, so run it in a
+    # thread to keep serving other requests meanwhile
+    all_entries = await asyncio.to_thread(
+        search_batch, my_duckdb, questions, max_sources
+    )
+
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+    async def answer(query: str, image_data: str | None, entries: list[DataEntry]):
+        async with semaphore:
+            return await answer_from_entries(query, image_data, entries)
+
+    return await asyncio.gather(
+        *(
+            answer(q["question"], q.get("image"), entries)
+            for q, entries in zip(questions, all_entries)
+        ),
+        return_exceptions=True,
+    )
+
+
+async def answer_from_entries(
+    query: str,
+    image_data: str | None,
+    entries: list[DataEntry],
+) -> dict[str, str | list[dict[str, str]]]:
     links = [{"text": entry["title"], "url": entry["url"]} for entry in entries]
     texts = list(chain([entry["text"] for entry in entries]))
 
@@ -45,7 +168,7 @@ def get_answer(
             },
         )
 
-    answer_response = openai_client.chat.completions.create(
+    answer_response = await chat_completion(
         model="gpt-4.1-nano",
         messages=[
             {
@@ -70,9 +193,9 @@ def get_answer(
             {"role": "user", "content": content},
         ],
     )
-    response_data = json.loads(answer_response.choices[0].message.content)
-    answer = response_data["answer"]
-    text_indexes = response_data["text_indexes"]
+    answer, text_indexes = parse_answer(
+        answer_response.choices[0].message.content or "", len(links)
+    )
     links = [links[i] for i in text_indexes]
     return {
         "answer": answer,
@@ -82,9 +205,9 @@ def get_answer(
 
 # Example usage
 if __name__ == "__main__":
-    my_duckdb = get_duckdb()
+    my_duckdb = get_duckdb(read_only=True)
     q = input("Enter your question: ")
-    result = get_answer(my_duckdb, q, None, 3)
+    result = asyncio.run(get_answer(my_duckdb, q, None, 3))
     print("\nAnswer:\n", result["answer"])
     print("\nSources:")
     for src in result["links"]:
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class StubSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="STUB_LLM_")
+
+    # Simulated model latency in seconds, drawn uniformly from [min, max]
+    LATENCY_MIN: float = 0.2
+    LATENCY_MAX: float = 0.8
+    # Fault injection, as fractions of requests
+    ERROR_RATE: float = 0.0  # Half 429s, half 500s
+    SLOW_RATE: float = 0.0  # Delayed by SLOW_LATENCY seconds
+    SLOW_LATENCY: float = 5.0
+    WRAP_RATE: float = 0.0  # JSON wrapped in prose and code fences
+
+
+stub_settings = StubSettings()
+
+app = FastAPI()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: dict):
+    """Answer like the OpenAI chat completions API, without calling any model."""
+    latency = random.uniform(stub_settings.LATENCY_MIN, stub_settings.LATENCY_MAX)
+    if random.random() < stub_settings.SLOW_RATE:
+        latency = stub_settings.SLOW_LATENCY
+    await asyncio.sleep(latency)
+
+    if random.random() < stub_settings.ERROR_RATE:
+        status_code = random.choice([429, 500])
+        return JSONResponse(
+            {"error": {"message": "Injected fault", "type": "stub_error"}},
+            status_code=status_code,
+        )
+
+    content = json.dumps(
+        {
+            "answer": "This is a stub answer.",
+            "text_indexes": [0],
+        }
+    )
+    if random.random() < stub_settings.WRAP_RATE:
+        content = f"Here is the answer:\n```json\n{content}\n```\nHope this helps!"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }